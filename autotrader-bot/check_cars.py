@@ -6,18 +6,24 @@ Sends Telegram notifications when new cars are found.
 """
 import os
 import json
+import hashlib
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Optional, Set, Dict, List
 from pathlib import Path
 from urllib.parse import urlencode
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 BOT_TOKEN: Optional[str] = None
 CHAT_ID: Optional[str] = None
 
-# File to store previously seen car IDs
+# File to store previously seen car IDs, one "<car_id> <last_seen>" pair per line
 STATE_FILE = Path(__file__).parent / "seen_cars.json"
+MAX_SEEN_CARS = 10000  # Oldest entries are evicted beyond this
 
 # Default search parameters - can be customized
 DEFAULT_MAKE = "BMW"
@@ -25,6 +31,48 @@ DEFAULT_MODEL = "3 Series"
 DEFAULT_POSTCODE = "E15 4EQ"
 DEFAULT_RADIUS = 150000  # Large radius to cover all of the UK
 
+# Shared HTTP session so repeated requests reuse pooled keep-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+# Listing selectors, built once and reused for every page. Each search
+# result card holds the title, specs, price, description and attention grabber.
+# NOTE: keep lookups on find()/find_all() with an explicit tag name and class;
+# .select() compiles a CSS selector on every call and is noticeably slower.
+_CARD_KW = {"name": "li", "attrs": {"class": "search-page__result"}}
+_TITLE_KW = {"name": "h2", "attrs": {"class": "listing-title"}}
+_DETAILS_KW = {"name": "ul", "attrs": {"class": "listing-key-specs"}}
+_COST_KW = {"name": "div", "attrs": {"class": "vehicle-price"}}
+_DESCRIPTION_KW = {"name": "p", "attrs": {"class": "listing-description"}}
+_ATTENTION_KW = {"name": "p", "attrs": {"class": "listing-attention-grabber"}}
+
+# Keywords that mark a listing as a write-off, matched in a single pass
+# against lower-cased listing text
+_WRITEOFF_RE = re.compile(
+    r"write[- ]?off|cat [sndcba]|category [sndc]|salvage|damaged"
+    r"|insurance write|accident damage|repaired damage"
+)
+
+# Total page count from the "Page X of Y" pagination label
+_PAGE_COUNT_RE = re.compile(r"of\s+(\d+)")
+
+# Notification block for a single car; lines for empty fields are removed
+# afterwards by _EMPTY_FIELD_RE
+_CAR_TEMPLATE = (
+    "\n📍 {title}\n"
+    "   {details}\n"
+    "   💰 {cost}\n"
+    "   📝 {description}\n"
+    "   ⭐ {attention_grabber}\n"
+    "   🔗 {url}\n"
+    "\n" + "=" * 40 + "\n"
+)
+_EMPTY_FIELD_RE = re.compile(r"^   (?:\S+ )?\n", re.MULTILINE)
+
+# Only build the parts of the page we actually read (result cards and pagination)
+STRAINER = SoupStrainer("li", attrs={"class": re.compile(r"search-page__result|paginationMini__count")})
+
 
 def startup():
     """Load environment variables"""
@@ -36,13 +84,15 @@ def startup():
 
 
 def notify(msg: str):
-    """Send Telegram notification"""
-    startup()
+    """Send Telegram notification
 
+    Expects startup() to have loaded the credentials already, so a batch
+    of messages reads the environment once and shares one connection.
+    """
     url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     response = None
     try:
-        response = requests.post(url, json={"chat_id": CHAT_ID, "text": msg}, timeout=10)
+        response = _SESSION.post(url, json={"chat_id": CHAT_ID, "text": msg}, timeout=10)
         response.raise_for_status()
         data = response.json()
         if not data.get("ok"):
@@ -56,24 +106,48 @@ def notify(msg: str):
         raise
 
 
-def load_seen_cars() -> Set[str]:
-    """Load previously seen car IDs from state file"""
+def load_seen_cars() -> Dict[str, int]:
+    """Load previously seen car IDs from state file
+
+    Returns a dict mapping car_id -> last-seen unix timestamp. Older state
+    files (JSON {"car_ids": [...]} or bare IDs) are still read, with a
+    timestamp of 0, and are rewritten in the current format on next save.
+    """
     if STATE_FILE.exists():
         try:
-            with open(STATE_FILE, 'r') as f:
-                data = json.load(f)
-                return set(data.get("car_ids", []))
+            raw = STATE_FILE.read_text(encoding="utf-8")
+            if raw.lstrip().startswith("{"):
+                return dict.fromkeys(json.loads(raw).get("car_ids", []), 0)
+            seen = {}
+            for line in raw.splitlines():
+                car_id, _, last_seen = line.partition(" ")
+                if car_id:
+                    seen[car_id] = int(last_seen or 0)
+            return seen
         except Exception as e:
             print(f"Warning: Could not load state file: {e}")
-            return set()
-    return set()
+            return {}
+    return {}
 
 
-def save_seen_cars(car_ids: Set[str]):
-    """Save seen car IDs to state file"""
+def save_seen_cars(seen_cars: Dict[str, int]):
+    """Save seen car IDs to state file
+
+    Keeps only the MAX_SEEN_CARS most recently seen cars so the file stays
+    bounded. Writes to a temporary file first so an interrupted run never
+    leaves a half-written state file behind.
+    """
+    if len(seen_cars) > MAX_SEEN_CARS:
+        newest = sorted(seen_cars.items(), key=lambda item: item[1], reverse=True)
+        seen_cars = dict(newest[:MAX_SEEN_CARS])
+
     try:
-        with open(STATE_FILE, 'w') as f:
-            json.dump({"car_ids": list(car_ids)}, f, indent=2)
+        tmp_file = STATE_FILE.with_suffix(".tmp")
+        tmp_file.write_text(
+            "\n".join(f"{car_id} {last_seen}" for car_id, last_seen in sorted(seen_cars.items())),
+            encoding="utf-8",
+        )
+        tmp_file.replace(STATE_FILE)
     except Exception as e:
         print(f"Warning: Could not save state file: {e}")
 
@@ -104,21 +178,29 @@ def url_constructor(make: str, model: str, postcode: str = DEFAULT_POSTCODE, rad
     return base + urlencode(params, doseq=True)
 
 
+def fetch_page(url: str) -> bytes:
+    """Fetch url and return the raw response body."""
+    response = _SESSION.get(url, timeout=10)
+    response.raise_for_status()
+    return response.content
+
+
+def make_soup(html: bytes) -> BeautifulSoup:
+    """Return a BeautifulSoup parser for an HTML document."""
+    return BeautifulSoup(html, "lxml", parse_only=STRAINER)
+
+
 def bs_setup(url: str) -> BeautifulSoup:
     """Fetch url and return a BeautifulSoup parser."""
-    response = requests.get(url, headers={"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"}, timeout=10)
-    response.raise_for_status()
-    return BeautifulSoup(response.text, "html.parser")
+    return make_soup(fetch_page(url))
 
 
-def get_pages(url: str) -> int:
-    """Return the total number of result pages for the base URL."""
+def _pages_from_soup(soup: BeautifulSoup) -> int:
+    """Return the total number of result pages from a parsed results page."""
     try:
-        soup = bs_setup(url)
-        page_number = soup.find("li", attrs={"class": "paginationMini__count"})
+        page_number = soup.find("li", class_="paginationMini__count")
         if page_number:
-            search_string = str(page_number.get_text)
-            match = re.search(r"(\d+)(?!.*\d)", search_string)
+            match = _PAGE_COUNT_RE.search(page_number.get_text())
             if match:
                 num_of_pages = match.group(1)
                 print(f"Found {num_of_pages} pages of results...")
@@ -135,41 +217,35 @@ def get_pages(url: str) -> int:
 def extract_car_id(title_element) -> Optional[str]:
     """Extract a unique car ID from the listing.
 
-    We'll use the title text + a hash of the title as the ID.
+    We'll use a stable digest of the title text as the ID.
     This isn't perfect but should work for tracking new listings.
     """
     if title_element:
         title_text = title_element.get_text("|", strip=True)
-        # Create a simple hash-like ID from the title
-        return str(hash(title_text))
+        # Built-in hash() is salted per process, so use a digest that is
+        # identical across runs and machines
+        return hashlib.blake2b(title_text.encode("utf-8"), digest_size=8).hexdigest()
     return None
 
 
-def is_writeoff(car_details: Dict) -> bool:
-    """Check if a car is a write-off by examining its description and details.
+def _node_text(node, separator: str = "|") -> str:
+    """Return the stripped text of a listing element, or "" if it is missing."""
+    if node is None:
+        return ""
+    return node.get_text(separator, strip=True)
+
 
-    Returns True if the car appears to be a write-off (should be excluded).
+def is_writeoff(raw_text: str) -> bool:
+    """Check if a car is a write-off by examining its listing text.
+
+    raw_text is the lower-cased title, details, description and attention
+    grabber of the listing. Returns True if the car appears to be a
+    write-off (should be excluded).
     """
-    writeoff_keywords = [
-        "write-off", "writeoff", "write off",
-        "cat s", "cat n", "cat d", "cat c", "cat b", "cat a",
-        "category s", "category n", "category d", "category c",
-        "salvage", "damaged", "insurance write",
-        "accident damage", "repaired damage"
-    ]
-
-    # Check description, attention grabber, and details
-    text_to_check = " ".join([
-        car_details.get("description", "").lower(),
-        car_details.get("attention_grabber", "").lower(),
-        car_details.get("details", "").lower(),
-        car_details.get("title", "").lower()
-    ])
-
-    for keyword in writeoff_keywords:
-        if keyword in text_to_check:
-            print(f"  ⚠️ Excluding car due to keyword: '{keyword}'")
-            return True
+    match = _WRITEOFF_RE.search(raw_text)
+    if match:
+        print(f"  ⚠️ Excluding car due to keyword: '{match.group(0)}'")
+        return True
 
     return False
 
@@ -186,46 +262,56 @@ def fetch_autotrader_cars(make: str, model: str, postcode: str = DEFAULT_POSTCOD
     cars = {}
 
     try:
-        pagination_value = get_pages(built_url)
+        # Page 1 gives both the pagination count and the first listings
+        print("Fetching page 1...")
+        first_soup = bs_setup(f"{built_url}1")
+        pagination_value = _pages_from_soup(first_soup)
         print(f"Parsing {pagination_value} page(s) of results...")
 
-        for page in range(1, min(pagination_value + 1, 6)):  # Limit to 5 pages max
-            print(f"Fetching page {page}...")
-            page_url = f"{built_url}{page}"
-            soup = bs_setup(page_url)
-
-            titles = soup.find_all("h2", attrs={"class": "listing-title"})
-            details = soup.find_all("ul", attrs={"class": "listing-key-specs"})
-            costs = soup.find_all("div", attrs={"class": "vehicle-price"})
-            descriptions = soup.find_all("p", attrs={"class": "listing-description"})
-            atten_grabbers = soup.find_all("p", attrs={"class": "listing-attention-grabber"})
-
-            for i, (title, detail, cost, description, atten_grabber) in enumerate(zip(
-                titles, details, costs, descriptions, atten_grabbers
-            )):
-                if all([title, detail, cost, description, atten_grabber]):
-                    car_id = extract_car_id(title)
-                    if car_id:
-                        # Try to extract URL from title link
-                        car_url = ""
-                        title_link = title.find("a")
-                        if title_link and title_link.get("href"):
-                            car_url = "https://www.autotrader.co.uk" + title_link.get("href")
-
-                        car_details = {
-                            "title": title.get_text("|", strip=True),
-                            "details": detail.get_text("|", strip=True),
-                            "cost": cost.get_text(strip=True),
-                            "description": description.get_text("|", strip=True),
-                            "attention_grabber": atten_grabber.get_text("|", strip=True),
-                            "url": car_url
-                        }
-
-                        # Filter out write-offs
-                        if not is_writeoff(car_details):
-                            cars[car_id] = car_details
-                        else:
-                            print(f"  Filtered out: {car_details['title']}")
+        pages = range(2, min(pagination_value + 1, 6))  # Limit to 5 pages max
+        page_urls = [f"{built_url}{page}" for page in pages]
+
+        # Remaining pages are independent, so download them concurrently
+        html_pages = []
+        if page_urls:
+            print(f"Fetching {len(page_urls)} more page(s)...")
+            with ThreadPoolExecutor(max_workers=len(page_urls)) as executor:
+                html_pages = list(executor.map(fetch_page, page_urls))
+
+        soups = [first_soup] + [make_soup(html) for html in html_pages]
+        for page, soup in enumerate(soups, start=1):
+            print(f"Parsing page {page}...")
+
+            # Walk the page once for the result cards and read each field from its card,
+            # so a card missing a field can't shift the others out of line
+            for card in soup.find_all(**_CARD_KW):
+                title = card.find(**_TITLE_KW)
+                car_id = extract_car_id(title)
+                if car_id:
+                    # Try to extract URL from title link
+                    car_url = ""
+                    title_link = title.find("a")
+                    if title_link and title_link.get("href"):
+                        car_url = "https://www.autotrader.co.uk" + title_link.get("href")
+
+                    car_details = {
+                        "title": _node_text(title),
+                        "details": _node_text(card.find(**_DETAILS_KW)),
+                        "cost": _node_text(card.find(**_COST_KW), ""),
+                        "description": _node_text(card.find(**_DESCRIPTION_KW)),
+                        "attention_grabber": _node_text(card.find(**_ATTENTION_KW)),
+                        "url": car_url
+                    }
+
+                    # Filter out write-offs, checking all text fields in one lower-cased buffer
+                    raw_text = " ".join((
+                        car_details["description"], car_details["attention_grabber"],
+                        car_details["details"], car_details["title"],
+                    )).lower()
+                    if not is_writeoff(raw_text):
+                        cars[car_id] = car_details
+                    else:
+                        print(f"  Filtered out: {car_details['title']}")
 
         print(f"Found {len(cars)} total listings")
         return cars
@@ -251,54 +337,30 @@ def format_car_notification(new_car_ids: Set[str], all_cars: Dict[str, Dict], ma
     header = f"🚗 New AutoTrader Alert!\n\n{len(new_car_ids)} new {make} {model}(s) found:\n"
     header += f"\n{'='*40}\n"
 
-    current_msg = header
+    # Build each message from parts and track its length, rather than
+    # concatenating strings just to measure them
+    current_parts = [header]
+    current_len = len(header)
     car_count = 0
 
     for car_id in sorted(new_car_ids):
         car = all_cars.get(car_id, {})
 
-        # Format car details
-        car_info = f"\n"
-
-        # Title
-        title = car.get("title", "Unknown")
-        car_info += f"📍 {title}\n"
-
-        # Details (year, mileage, etc.)
-        details = car.get("details", "")
-        if details:
-            car_info += f"   {details}\n"
-
-        # Price
-        cost = car.get("cost", "N/A")
-        if cost:
-            car_info += f"   💰 {cost}\n"
-
-        # Description
-        description = car.get("description", "")
-        if description:
-            car_info += f"   📝 {description}\n"
-
-        # Attention grabber (e.g., "Great price", "Low mileage")
-        attention = car.get("attention_grabber", "")
-        if attention:
-            car_info += f"   ⭐ {attention}\n"
-
-        # URL
-        url = car.get("url", "")
-        if url:
-            car_info += f"   🔗 {url}\n"
-
-        car_info += f"\n{'='*40}\n"
+        # Format car details (title, specs, price, description,
+        # attention grabber e.g. "Great price", and URL)
+        fields = defaultdict(str, {"title": "Unknown", "cost": "N/A", **car})
+        car_info = _EMPTY_FIELD_RE.sub("", _CAR_TEMPLATE.format_map(fields))
 
         # Check if adding this car would exceed Telegram's limit (4096 chars)
-        if len(current_msg + car_info) > 4000:
+        if current_len + len(car_info) > 4000:
             # Save current message and start a new one
-            messages.append(current_msg)
-            current_msg = f"🚗 Continued ({car_count + 1}/{len(new_car_ids)})...\n\n"
-            current_msg += car_info
-        else:
-            current_msg += car_info
+            messages.append("".join(current_parts))
+            continuation_header = f"🚗 Continued ({car_count + 1}/{len(new_car_ids)})...\n\n"
+            current_parts = [continuation_header]
+            current_len = len(continuation_header)
+
+        current_parts.append(car_info)
+        current_len += len(car_info)
 
         car_count += 1
 
@@ -312,12 +374,12 @@ def format_car_notification(new_car_ids: Set[str], all_cars: Dict[str, Dict], ma
     footer += f"• Condition: No write-offs\n"
 
     # Check if footer fits in current message
-    if len(current_msg + footer) > 4000:
-        messages.append(current_msg)
+    if current_len + len(footer) > 4000:
+        messages.append("".join(current_parts))
         messages.append(footer)
     else:
-        current_msg += footer
-        messages.append(current_msg)
+        current_parts.append(footer)
+        messages.append("".join(current_parts))
 
     return messages
 
@@ -348,33 +410,44 @@ def main():
     seen_cars = load_seen_cars()
     print(f"Previously seen cars: {len(seen_cars)}")
 
-    # Fetch current listings from AutoTrader
-    all_cars = fetch_autotrader_cars(make, model, postcode, radius)
-    current_cars = set(all_cars.keys())
-
-    print(f"Current cars found: {len(current_cars)}")
-
-    # Detect NEW cars only (current cars that we haven't seen before)
-    new_cars = current_cars - seen_cars
+    try:
+        # Fetch current listings from AutoTrader
+        all_cars = fetch_autotrader_cars(make, model, postcode, radius)
+        current_cars = set(all_cars.keys())
+
+        print(f"Current cars found: {len(current_cars)}")
+
+        # Detect NEW cars only (current cars that we haven't seen before)
+        new_cars = current_cars - seen_cars.keys()
+
+        if new_cars:
+            print(f"\n🎉 Found {len(new_cars)} new car(s)!")
+
+            # Send notification(s) ONLY for new cars
+            try:
+                startup()
+                messages = format_car_notification(new_cars, all_cars, make, model)
+                for i, message in enumerate(messages):
+                    print(f"\nSending notification {i+1}/{len(messages)}...")
+                    notify(message)
+            except Exception as e:
+                print(f"Failed to send notification: {e}")
+        else:
+            print("\nℹ No new cars found")
+    finally:
+        _SESSION.close()
 
+    # Merge current cars into the seen set rather than replacing it, so cars that
+    # drop off the results and come back later aren't reported again. Only write
+    # when new IDs appear; refreshed timestamps alone don't warrant a rewrite.
     if new_cars:
-        print(f"\n🎉 Found {len(new_cars)} new car(s)!")
-
-        # Send notification(s) ONLY for new cars
-        try:
-            messages = format_car_notification(new_cars, all_cars, make, model)
-            for i, message in enumerate(messages):
-                print(f"\nSending notification {i+1}/{len(messages)}...")
-                notify(message)
-        except Exception as e:
-            print(f"Failed to send notification: {e}")
+        now = int(time.time())
+        updated_cars = dict(seen_cars)
+        updated_cars.update(dict.fromkeys(current_cars, now))
+        save_seen_cars(updated_cars)
+        print(f"\n✓ State updated with {len(new_cars)} new car(s)")
     else:
-        print("\nℹ No new cars found")
-
-    # Save all current cars to state file
-    if current_cars:
-        save_seen_cars(current_cars)
-        print(f"\n✓ State updated with {len(current_cars)} car(s)")
+        print("\nℹ State unchanged")
 
     print("="*60)
 